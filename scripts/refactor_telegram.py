@@ -6,12 +6,122 @@ Telegram Handler 重构助手脚本
 提取函数和生成新的文件结构。
 """
 
+import hashlib
+import mmap
 import os
+import pickle
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
 from typing import List, Dict, Tuple
 
+__version__ = "1.4.0"
+
+# 分析结果缓存目录，缓存按脚本版本和源文件内容的 SHA256 区分
+_CACHE_DIR = Path.home() / ".cache" / "refactor_telegram"
+
+# 输出文件写缓冲大小，整个文件通常一次系统调用写完
+_WRITE_BUFFER_SIZE = 1 << 20
+
+# Go 源码匹配用的正则表达式，模块加载时编译一次
+_FUNC_RE = re.compile(rb'func\s+(\([^)]*\))?\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*\([^)]*\)([^{]*)?{')
+_CONST_RE = re.compile(rb'const\s+(\w+)\s*=\s*([^/\n]+)')
+_TYPE_RE = re.compile(rb'type\s+(\w+)\s+struct\s*{[^}]*}', re.DOTALL)
+_BRACE_RE = re.compile(rb'[{}]')
+
+# 函数分类规则，按顺序匹配，命中第一个即返回
+# 每条规则为 (分类, 前缀, 中缀)：名称以前缀开头，且中缀为 None 或出现在前缀之后，
+# 例如 ('command', 'handle', 'Command') 等价于正则 handle.*Command
+_CATEGORY_RULES = [
+    ('command', 'handle', 'Command'),
+    ('command', ('handleStart', 'handleHelp', 'handleDownload', 'handleList', 'handleCancel',
+                 'handleTasks', 'handleAddTask', 'handleQuickTask', 'handleDelTask', 'handleRunTask'), None),
+    ('callback', 'handle', 'Callback'),
+    ('callback', 'handle', 'WithEdit'),
+    ('callback', ('handleCallbackQuery',), None),
+    ('render', ('render',), None),
+    ('render', 'get', 'Keyboard'),
+    ('render', 'get', 'Menu'),
+    ('util', ('format', 'escape', 'split', 'encode', 'decode'), None),
+    ('message', ('send', 'edit', 'answer'), None),
+    ('file', ('handleFile', 'handleBrowse', 'handleDownloadFile'), None),
+    ('task', ('handleTask', 'handleQuick', 'handleAdd', 'handleDel', 'handleRun'), None),
+    ('system', ('handleSystem', 'handleHealth', 'handleAlist'), None),
+    ('manual', ('handleManual', 'parseTime', 'callManual'), None),
+]
+
+# 纯字面量前缀直接决定分类，不会被排在前面的通配规则抢先匹配；
+# handle/get 开头的名称依赖带中缀规则的优先级，仍交给 _CATEGORY_RULES
+_CATEGORY_PREFIXES = [
+    ('render', 'render'),
+    ('format', 'util'), ('escape', 'util'), ('split', 'util'), ('encode', 'util'), ('decode', 'util'),
+    ('send', 'message'), ('edit', 'message'), ('answer', 'message'),
+    ('parseTime', 'manual'), ('callManual', 'manual'),
+]
+
+def _build_prefix_trie(prefixes: List[Tuple[str, str]]) -> Dict:
+    """构建前缀树，节点为 {字符: 子节点}，前缀结束处的 None 键保存分类"""
+    trie = {}
+    for prefix, category in prefixes:
+        node = trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = category
+    return trie
+
+_CATEGORY_TRIE = _build_prefix_trie(_CATEGORY_PREFIXES)
+
+# 重构后的目录结构，目录名同时作为生成文件的 package 名
+_TARGET_DIRECTORIES = [
+    'interfaces', 'core', 'commands', 'callbacks',
+    'renderers', 'utils', 'config', 'types'
+]
+
+# 迁移函数前的注释行后缀
+_FUNC_COMMENT_SUFFIX = " - 从原文件迁移\n".encode('utf-8')
+
+# 函数分配规则：分类 -> ([(名称关键字, 目标文件)], 默认文件)，关键字按顺序匹配
+_FILE_RULES = {
+    'command': ([
+        ('download', 'commands/download.go'),
+        ('file', 'commands/file.go'),
+        ('browse', 'commands/file.go'),
+        ('list', 'commands/file.go'),
+        ('task', 'commands/task.go'),
+        ('quick', 'commands/task.go'),
+        ('add', 'commands/task.go'),
+        ('del', 'commands/task.go'),
+        ('run', 'commands/task.go'),
+        ('system', 'commands/system.go'),
+        ('health', 'commands/system.go'),
+        ('alist', 'commands/system.go'),
+        ('start', 'commands/help.go'),
+        ('help', 'commands/help.go'),
+    ], 'commands/base.go'),
+    'callback': ([
+        ('menu', 'callbacks/menu.go'),
+        ('file', 'callbacks/file_ops.go'),
+        ('download', 'callbacks/download_ops.go'),
+        ('preview', 'callbacks/preview.go'),
+        ('manual', 'callbacks/preview.go'),
+    ], 'callbacks/base.go'),
+    'util': ([
+        ('format', 'utils/formatter.go'),
+        ('escape', 'utils/formatter.go'),
+        ('split', 'utils/formatter.go'),
+        ('send', 'utils/message_sender.go'),
+        ('edit', 'utils/message_sender.go'),
+        ('answer', 'utils/message_sender.go'),
+        ('encode', 'utils/encoder.go'),
+        ('decode', 'utils/encoder.go'),
+        ('path', 'utils/encoder.go'),
+        ('parse', 'utils/validator.go'),
+        ('valid', 'utils/validator.go'),
+    ], None),
+}
+
 class TelegramRefactorHelper:
     def __init__(self, source_file: str, target_dir: str):
         self.source_file = source_file
@@ -19,71 +129,134 @@ class TelegramRefactorHelper:
         self.functions = {}
         self.constants = {}
         self.types = {}
+        self._source_shm = None
+        # 每个 package 的文件头只依赖源文件路径，提前编码好供所有生成文件复用
+        self._file_headers = {
+            package_name: f"""package {package_name}
+
+// 此文件由重构脚本自动生成
+// 源文件: {source_file}
+
+import (
+	// TODO: 添加必要的导入
+)
+
+""".encode('utf-8')
+            for package_name in _TARGET_DIRECTORIES
+        }
         
     def analyze_source_file(self):
         """分析源文件，提取函数、常量和类型定义"""
         print(f"📖 分析源文件: {self.source_file}")
         
-        with open(self.source_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 提取函数定义
-        self._extract_functions(content)
-        
-        # 提取常量
-        self._extract_constants(content)
-        
-        # 提取类型定义
-        self._extract_types(content)
+        fd = os.open(self.source_file, os.O_RDONLY)
+        try:
+            if os.fstat(fd).st_size == 0:
+                content = b""
+            else:
+                content = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        
+        try:
+            cache_path = self._cache_path(content)
+            from_cache = self._load_cache(cache_path)
+            if not from_cache:
+                # 提取函数定义
+                self._extract_functions(content)
+                
+                # 提取常量
+                self._extract_constants(content)
+                
+                # 提取类型定义
+                self._extract_types(content)
+            
+            # 函数只记录偏移，源文件内容放入共享内存供写入进程读取
+            self._share_source(content)
+        finally:
+            if isinstance(content, mmap.mmap):
+                content.close()
+        
+        if from_cache:
+            print(f"✅ 分析完成(缓存): 找到 {len(self.functions)} 个函数")
+            return
         
+        self._save_cache(cache_path)
         print(f"✅ 分析完成: 找到 {len(self.functions)} 个函数")
+    
+    def _share_source(self, content: bytes):
+        """把源文件内容复制到共享内存块"""
+        self.close()
+        if len(content) == 0:
+            return
         
-    def _extract_functions(self, content: str):
+        self._source_shm = shared_memory.SharedMemory(create=True, size=len(content))
+        self._source_shm.buf[:len(content)] = content
+    
+    def close(self):
+        """释放源文件共享内存"""
+        if self._source_shm is not None:
+            self._source_shm.close()
+            self._source_shm.unlink()
+            self._source_shm = None
+    
+    def _cache_path(self, content: bytes) -> Path:
+        """根据脚本版本和源文件内容计算缓存路径"""
+        digest = hashlib.sha256(__version__.encode('utf-8'))
+        digest.update(content)
+        return _CACHE_DIR / f"{digest.hexdigest()}.pkl"
+    
+    def _load_cache(self, cache_path: Path) -> bool:
+        """读取分析结果缓存，缓存不存在或损坏时返回 False"""
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"⚠️  忽略损坏的缓存 {cache_path}: {e}")
+            return False
+        
+        # pickle 不保留字符串驻留，加载后重新驻留函数名
+        self.functions = {sys.intern(name): info for name, info in cached['functions'].items()}
+        self.constants = cached['constants']
+        self.types = cached['types']
+        return True
+    
+    def _save_cache(self, cache_path: Path):
+        """保存分析结果缓存，写入失败不影响重构流程"""
+        cached = {
+            'functions': self.functions,
+            'constants': self.constants,
+            'types': self.types,
+        }
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump(cached, f, protocol=5)
+        except OSError as e:
+            print(f"⚠️  写入缓存失败 {cache_path}: {e}")
+        
+    def _extract_functions(self, content: bytes):
         """提取函数定义"""
-        # 匹配Go函数定义的正则表达式
-        function_pattern = r'func\s+(\([^)]*\))?\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*\([^)]*\)([^{]*)?{'
-        
-        matches = re.finditer(function_pattern, content)
-        for match in matches:
-            receiver = match.group(1) or ""
-            name = match.group(2)
-            
-            # 提取完整的函数体
-            start_pos = match.start()
-            brace_count = 0
-            pos = match.end() - 1  # 从第一个 { 开始
-            
-            while pos < len(content):
-                if content[pos] == '{':
-                    brace_count += 1
-                elif content[pos] == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        break
-                pos += 1
-            
-            if brace_count == 0:
-                function_body = content[start_pos:pos+1]
-                self.functions[name] = {
-                    'receiver': receiver.strip(),
-                    'body': function_body,
-                    'category': self._categorize_function(name)
-                }
+        for raw_name, receiver, start, end in _scan_functions(content):
+            name = sys.intern(raw_name.decode('utf-8'))
+            self.functions[name] = {
+                'receiver': receiver.decode('utf-8').strip(),
+                'start': start,
+                'end': end,
+                'category': self._categorize_function(name),
+                'lname': name.lower(),
+            }
     
-    def _extract_constants(self, content: str):
+    def _extract_constants(self, content: bytes):
         """提取常量定义"""
-        # 匹配const定义
-        const_pattern = r'const\s+(\w+)\s*=\s*([^/\n]+)'
-        matches = re.findall(const_pattern, content)
-        
-        for name, value in matches:
-            self.constants[name] = value.strip()
+        for name, value in _CONST_RE.findall(content):
+            self.constants[name.decode('utf-8')] = value.decode('utf-8').strip()
     
-    def _extract_types(self, content: str):
+    def _extract_types(self, content: bytes):
         """提取类型定义"""
-        # 匹配type定义
-        type_pattern = r'type\s+(\w+)\s+struct\s*{[^}]*}'
-        matches = re.findall(type_pattern, content, re.DOTALL)
+        matches = _TYPE_RE.findall(content)
         
         for match in matches:
             # 这里需要更复杂的解析逻辑
@@ -91,22 +264,19 @@ class TelegramRefactorHelper:
     
     def _categorize_function(self, name: str) -> str:
         """根据函数名称分类函数"""
-        categories = {
-            'command': ['handle.*Command', 'handle(Start|Help|Download|List|Cancel|Tasks|AddTask|QuickTask|DelTask|RunTask)'],
-            'callback': ['handle.*Callback', 'handle.*WithEdit', 'handleCallbackQuery'],
-            'render': ['render.*', 'get.*Keyboard', 'get.*Menu'],
-            'util': ['format.*', 'escape.*', 'split.*', 'encode.*', 'decode.*'],
-            'message': ['send.*', 'edit.*', 'answer.*'],
-            'file': ['handleFile.*', 'handleBrowse.*', 'handleDownloadFile.*'],
-            'task': ['handleTask.*', 'handleQuick.*', 'handleAdd.*', 'handleDel.*', 'handleRun.*'],
-            'system': ['handleSystem.*', 'handleHealth.*', 'handleAlist.*'],
-            'manual': ['handleManual.*', 'parseTime.*', 'callManual.*'],
-        }
-        
-        for category, patterns in categories.items():
-            for pattern in patterns:
-                if re.match(pattern, name):
-                    return category
+        # 先沿前缀树逐字符查找字面量前缀
+        node = _CATEGORY_TRIE
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                return node[None]
+        
+        # 再按顺序检查完整规则，多前缀 startswith 在 C 层完成
+        for category, prefix, infix in _CATEGORY_RULES:
+            if name.startswith(prefix) and (infix is None or name.find(infix, len(prefix)) != -1):
+                return category
         
         return 'other'
     
@@ -115,12 +285,7 @@ class TelegramRefactorHelper:
         print("🏗️  生成新的文件结构...")
         
         # 创建目录结构
-        directories = [
-            'interfaces', 'core', 'commands', 'callbacks', 
-            'renderers', 'utils', 'config', 'types'
-        ]
-        
-        for dir_name in directories:
+        for dir_name in _TARGET_DIRECTORIES:
             dir_path = self.target_dir / dir_name
             dir_path.mkdir(parents=True, exist_ok=True)
             print(f"   📁 创建目录: {dir_path}")
@@ -128,9 +293,18 @@ class TelegramRefactorHelper:
         # 生成文件映射
         file_mapping = self._get_file_mapping()
         
-        # 生成各个文件
-        for file_path, functions in file_mapping.items():
-            self._generate_file(file_path, functions)
+        # 生成各个文件，文件之间互不依赖，交给进程池并行写入
+        tasks = [
+            self._prepare_file(file_path, functions)
+            for file_path, functions in file_mapping.items()
+            if functions
+        ]
+        with ProcessPoolExecutor() as executor:
+            written = list(executor.map(_generate_file, tasks))
+        
+        unchanged = written.count(False)
+        if unchanged:
+            print(f"   ⏭️  {unchanged} 个文件内容未变化，跳过写入")
     
     def _get_file_mapping(self) -> Dict[str, List[str]]:
         """获取文件映射关系"""
@@ -154,78 +328,36 @@ class TelegramRefactorHelper:
         
         # 根据分类将函数分配到对应文件
         for func_name, func_info in self.functions.items():
-            category = func_info['category']
-            
-            if category == 'command':
-                if 'download' in func_name.lower():
-                    mapping['commands/download.go'].append(func_name)
-                elif any(word in func_name.lower() for word in ['file', 'browse', 'list']):
-                    mapping['commands/file.go'].append(func_name)
-                elif any(word in func_name.lower() for word in ['task', 'quick', 'add', 'del', 'run']):
-                    mapping['commands/task.go'].append(func_name)
-                elif any(word in func_name.lower() for word in ['system', 'health', 'alist']):
-                    mapping['commands/system.go'].append(func_name)
-                elif any(word in func_name.lower() for word in ['start', 'help']):
-                    mapping['commands/help.go'].append(func_name)
-                else:
-                    mapping['commands/base.go'].append(func_name)
+            rules = _FILE_RULES.get(func_info['category'])
+            if rules is None:
+                continue
             
-            elif category == 'callback':
-                if 'menu' in func_name.lower():
-                    mapping['callbacks/menu.go'].append(func_name)
-                elif 'file' in func_name.lower():
-                    mapping['callbacks/file_ops.go'].append(func_name)
-                elif 'download' in func_name.lower():
-                    mapping['callbacks/download_ops.go'].append(func_name)
-                elif 'preview' in func_name.lower() or 'manual' in func_name.lower():
-                    mapping['callbacks/preview.go'].append(func_name)
-                else:
-                    mapping['callbacks/base.go'].append(func_name)
+            keyword_rules, default_path = rules
+            lower_name = func_info['lname']
+            target = default_path
+            for keyword, path in keyword_rules:
+                if keyword in lower_name:
+                    target = path
+                    break
             
-            elif category == 'util':
-                if any(word in func_name.lower() for word in ['format', 'escape', 'split']):
-                    mapping['utils/formatter.go'].append(func_name)
-                elif any(word in func_name.lower() for word in ['send', 'edit', 'answer']):
-                    mapping['utils/message_sender.go'].append(func_name)
-                elif any(word in func_name.lower() for word in ['encode', 'decode', 'path']):
-                    mapping['utils/encoder.go'].append(func_name)
-                elif any(word in func_name.lower() for word in ['parse', 'valid']):
-                    mapping['utils/validator.go'].append(func_name)
+            if target is not None:
+                mapping[target].append(func_name)
         
         return mapping
     
-    def _generate_file(self, relative_path: str, function_names: List[str]):
-        """生成单个文件"""
-        if not function_names:
-            return
-            
+    def _prepare_file(self, relative_path: str, function_names: List[str]) -> Tuple[Path, bytes, str, List[Tuple[bytes, int, int]]]:
+        """准备单个文件的生成参数，函数体只以源文件中的偏移传递"""
         file_path = self.target_dir / relative_path
         package_name = relative_path.split('/')[0]
         
         print(f"   📄 生成文件: {file_path}")
         
-        # 生成文件头部
-        content = f"""package {package_name}
-
-// 此文件由重构脚本自动生成
-// 源文件: {self.source_file}
-
-import (
-	// TODO: 添加必要的导入
-)
-
-"""
-        
-        # 添加函数
-        for func_name in function_names:
-            if func_name in self.functions:
-                func_info = self.functions[func_name]
-                content += f"// {func_name} - 从原文件迁移\n"
-                content += func_info['body'] + "\n\n"
-        
-        # 写入文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        functions = [
+            (func_name.encode('utf-8'), self.functions[func_name]['start'], self.functions[func_name]['end'])
+            for func_name in function_names
+            if func_name in self.functions
+        ]
+        return file_path, self._file_headers[package_name], self._source_shm.name, functions
     
     def generate_summary_report(self):
         """生成重构摘要报告"""
@@ -233,7 +365,7 @@ import (
         
         print(f"📊 生成重构报告: {report_path}")
         
-        content = f"""# Telegram Handler 重构摘要
+        parts = [f"""# Telegram Handler 重构摘要
 
 ## 原始文件分析
 - 源文件: `{self.source_file}`
@@ -241,7 +373,7 @@ import (
 - 常量总数: {len(self.constants)}
 
 ## 函数分类统计
-"""
+"""]
         
         # 统计各类别函数数量
         categories = {}
@@ -250,22 +382,24 @@ import (
             categories[category] = categories.get(category, 0) + 1
         
         for category, count in sorted(categories.items()):
-            content += f"- {category}: {count} 个函数\n"
+            parts.append(f"- {category}: {count} 个函数\n")
         
-        content += "\n## 重构后文件结构\n\n"
-        content += "```\n"
-        content += "telegram/\n"
+        parts.append("\n## 重构后文件结构\n\n")
+        parts.append("```\n")
+        parts.append("telegram/\n")
         
-        for dir_name in ['interfaces', 'core', 'commands', 'callbacks', 'renderers', 'utils', 'config', 'types']:
-            content += f"├── {dir_name}/\n"
+        for dir_name in _TARGET_DIRECTORIES:
+            parts.append(f"├── {dir_name}/\n")
             dir_path = self.target_dir / dir_name
             if dir_path.exists():
-                for file_path in sorted(dir_path.glob("*.go")):
-                    content += f"│   ├── {file_path.name}\n"
+                with os.scandir(dir_path) as entries:
+                    file_names = sorted(entry.name for entry in entries if entry.name.endswith('.go'))
+                for file_name in file_names:
+                    parts.append(f"│   ├── {file_name}\n")
         
-        content += "```\n\n"
+        parts.append("```\n\n")
         
-        content += """## 下一步行动
+        parts.append("""## 下一步行动
 
 1. ✅ 已完成结构化提取
 2. 🔄 需要手动调整导入依赖
@@ -278,10 +412,94 @@ import (
 - 生成的文件需要手动调整导入语句
 - 函数间的依赖关系需要重新整理
 - 建议逐步迁移，保持原文件作为备份
-"""
+""")
         
-        with open(report_path, 'w', encoding='utf-8') as f:
+        with open(report_path, 'wb', buffering=_WRITE_BUFFER_SIZE) as f:
+            f.write(''.join(parts).encode('utf-8'))
+
+def _match_braces(content: bytes) -> Dict[int, int]:
+    """一次遍历所有花括号，返回 { 的位置到与之配对的 } 的位置的映射"""
+    pairs = {}
+    stack = []
+    for match in _BRACE_RE.finditer(content):
+        pos = match.start()
+        if content[pos] == 0x7B:  # {
+            stack.append(pos)
+        elif stack:
+            pairs[stack.pop()] = pos
+    return pairs
+
+def _scan_functions(content: bytes) -> List[Tuple[bytes, bytes, int, int]]:
+    """扫描函数定义，返回 (函数名, 接收者, 起始位置, 结束位置) 列表
+
+    只处理字节和整数偏移，不依赖 TelegramRefactorHelper 的状态，
+    需要时可以整体替换为编译实现。
+    """
+    # 一次扫描得到所有配对的花括号，函数体结束位置直接查表
+    brace_pairs = _match_braces(content)
+    
+    spans = []
+    for match in _FUNC_RE.finditer(content):
+        close_pos = brace_pairs.get(match.end() - 1)  # 第一个 { 的位置
+        if close_pos is not None:
+            spans.append((
+                match.group(2),
+                match.group(1) or b"",
+                match.start(),
+                close_pos + 1,
+            ))
+    return spans
+
+def _generate_file(task: Tuple[Path, bytes, str, List[Tuple[bytes, int, int]]]) -> bool:
+    """生成单个文件，定义在模块级以便进程池序列化，返回是否实际写入"""
+    file_path, header, shm_name, functions = task
+    parts = [header]
+    
+    # 添加函数，函数体直接从共享内存中的源文件切片
+    source = shared_memory.SharedMemory(name=shm_name)
+    try:
+        for func_name, start, end in functions:
+            parts.append(b"// " + func_name + _FUNC_COMMENT_SUFFIX)
+            parts.append(bytes(source.buf[start:end]))
+            parts.append(b"\n\n")
+    finally:
+        source.close()
+    
+    # 内容未变化时不重写，避免无谓地使 gofmt/go build 的缓存失效
+    content = b''.join(parts)
+    if _file_matches(file_path, content):
+        return False
+    
+    # 先写临时文件再原子替换，中断时不会留下写了一半的目标文件
+    tmp_path = file_path.with_name(file_path.name + '.tmp')
+    try:
+        with open(tmp_path, 'wb', buffering=_WRITE_BUFFER_SIZE) as f:
             f.write(content)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return True
+
+def _file_matches(file_path: Path, content: bytes) -> bool:
+    """判断磁盘上的文件是否与给定内容一致"""
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    
+    try:
+        size = os.fstat(fd).st_size
+        if size != len(content):
+            return False
+        if size == 0:
+            return True
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as existing:
+            existing_digest = hashlib.blake2b(existing, digest_size=16).digest()
+    finally:
+        os.close(fd)
+    
+    return existing_digest == hashlib.blake2b(content, digest_size=16).digest()
 
 def main():
     """主函数"""
@@ -329,6 +547,8 @@ def main():
     except Exception as e:
         print(f"❌ 执行过程中发生错误: {e}")
         sys.exit(1)
+    finally:
+        helper.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file